@@ -2,16 +2,47 @@
 """
 ZeroMQ PUB Server for testing Zig SUB client implementation.
 This server binds to tcp://127.0.0.1:5555 and publishes messages with different topics.
+Each message is a single "topic payload" frame, as the Zig SUB examples expect;
+--multipart sends the topic and the payload as two frames instead.
 """
 
+import argparse
+import logging
 import zmq
 import time
 import sys
 
+from cpu_affinity import pin_to_cpus
+
+# Topics and pre-encoded payload templates
+WEATHER = b"weather"
+NEWS = b"news"
+SPORTS = b"sports"
+WEATHER_TMPL = "Temperature: %d°C, Humidity: %d%%".encode()
+NEWS_TMPL = b"Breaking news #%d: Important event occurred"
+SPORTS_TMPL = b"Game %d: Team A vs Team B"
+
+log = logging.getLogger(__name__)
+
 
 def main():
+    parser = argparse.ArgumentParser(description="ZeroMQ PUB test server")
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help="log every published message")
+    parser.add_argument('--multipart', action='store_true',
+                        help="send topic and payload as separate frames")
+    parser.add_argument('--interval', type=float, default=1.5,
+                        help="seconds to sleep after each weather/news/sports batch; "
+                             "0 publishes as fast as possible (default: 1.5)")
+    args = parser.parse_args()
+
+    # Per-message detail only with -v
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO, format='%(message)s')
+
     print("=== ZeroMQ PUB Server (Python) ===")
 
+    pin_to_cpus()
+
     # Create context and PUB socket
     context = zmq.Context()
     socket = context.socket(zmq.PUB)
@@ -20,6 +51,28 @@ def main():
     endpoint = "tcp://127.0.0.1:5555"
     socket.bind(endpoint)
     print(f"Publisher bound to {endpoint}")
+
+    if args.multipart:
+        # Topic frame + payload frame; subscribers match only the topic frame
+        weather_tmpl, news_tmpl, sports_tmpl = WEATHER_TMPL, NEWS_TMPL, SPORTS_TMPL
+
+        def publish(number, topic, payload):
+            socket.send_multipart([topic, payload], copy=False)
+            if __debug__ and log.isEnabledFor(logging.DEBUG):
+                log.debug("[%d] Published: %s %s", number, topic.decode(), payload.decode())
+    else:
+        # One frame with the topic prefix baked into the template
+        weather_tmpl = WEATHER + b" " + WEATHER_TMPL
+        news_tmpl = NEWS + b" " + NEWS_TMPL
+        sports_tmpl = SPORTS + b" " + SPORTS_TMPL
+
+        def publish(number, topic, payload):
+            socket.send(payload, copy=False)
+            if __debug__ and log.isEnabledFor(logging.DEBUG):
+                log.debug("[%d] Published: %s", number, payload.decode())
+
+    if not args.verbose:
+        print("Run with -v to print every published message")
     print("Publishing messages... (Press Ctrl+C to exit)\n")
 
     # Give subscribers time to connect
@@ -29,25 +82,21 @@ def main():
         count = 0
         while True:
             # Publish weather updates
-            weather_msg = f"weather Temperature: {20 + (count % 10)}°C, Humidity: {50 + (count % 30)}%"
-            socket.send_string(weather_msg)
-            print(f"[{count * 3}] Published: {weather_msg}")
-
-            time.sleep(0.5)
+            weather_msg = weather_tmpl % (20 + (count % 10), 50 + (count % 30))
+            publish(count * 3, WEATHER, weather_msg)
 
             # Publish news updates
-            news_msg = f"news Breaking news #{count}: Important event occurred"
-            socket.send_string(news_msg)
-            print(f"[{count * 3 + 1}] Published: {news_msg}")
-
-            time.sleep(0.5)
+            news_msg = news_tmpl % count
+            publish(count * 3 + 1, NEWS, news_msg)
 
             # Publish sports updates
-            sports_msg = f"sports Game {count}: Team A vs Team B"
-            socket.send_string(sports_msg)
-            print(f"[{count * 3 + 2}] Published: {sports_msg}")
+            sports_msg = sports_tmpl % count
+            publish(count * 3 + 2, SPORTS, sports_msg)
 
-            time.sleep(0.5)
+            # One wakeup per batch. With 0 the loop never sleeps; PUB does not
+            # block at the high-water mark, it drops messages for slow subscribers
+            if args.interval:
+                time.sleep(args.interval)
 
             count += 1
 
@@ -1,35 +1,76 @@
+import argparse
+import asyncio
+import logging
+import sys
 import zmq
-import time
+
+try:
+    from tornado import ioloop
+    from zmq.eventloop import zmqstream
+except ImportError:
+    sys.exit("ZMQRepServer.py needs tornado: pip install tornado (uvloop is optional)")
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+from cpu_affinity import pin_to_cpus
+
+log = logging.getLogger(__name__)
+
+# Reply frame shared by every send; libzmq references it instead of copying
+REPLY = zmq.Frame(b"World")
 
 def main():
+    parser = argparse.ArgumentParser(description="ZMQ REP test server on the tornado IOLoop")
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help="log every request and reply")
+    args = parser.parse_args()
+
+    # Per-message detail only with -v
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO, format='%(message)s')
+
+    # Run the tornado loop on uvloop when it is installed
+    if uvloop is not None:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    loop = ioloop.IOLoop.current()
+
+    pin_to_cpus()
+
     # Create ZMQ context and socket
     context = zmq.Context()
     socket = context.socket(zmq.REP)  # REP socket pairs with REQ
-    
+
     # Bind to the address your Zig client connects to
     socket.bind("tcp://127.0.0.1:42123")
-    
+
     print("ZMQ REP server listening on tcp://127.0.0.1:42123")
     print("Waiting for connections...")
 
     # Add debug flag
     socket.setsockopt(zmq.LINGER, 0)
 
-    try:
-        while True:
-            print("DEBUG: About to call recv()...")
-            message = socket.recv()
-            print(f"Received request: {message}")
-            print(f"Raw bytes: {message.hex()}")
+    # Requests are handled from the event loop as they arrive
+    stream = zmqstream.ZMQStream(socket, loop)
 
-            reply = b"World"
-            socket.send(reply)
-            print(f"Sent reply: {reply}")
+    def on_recv(frames):
+        message = frames[0]
+        if __debug__ and log.isEnabledFor(logging.DEBUG):
+            log.debug("Received request: %s", message)
+            log.debug("Raw bytes: %s", message.hex())
 
+        stream.send(REPLY, copy=False, track=False)
+        log.debug("Sent reply: %s", REPLY.bytes)
+
+    stream.on_recv(on_recv)
+
+    try:
+        loop.start()
     except KeyboardInterrupt:
         print("\nShutting down server...")
     finally:
-        socket.close()
+        stream.close()
         context.term()
 
 
@@ -2,6 +2,7 @@
 """
 ZeroMQ SUB Client for testing Zig PUB server implementation.
 This client connects to tcp://127.0.0.1:5555 and subscribes to messages.
+Topic and payload may arrive as separate frames or as a single frame.
 """
 
 import zmq
@@ -21,23 +22,29 @@ def main():
     print(f"Connected to publisher at {endpoint}")
 
     # Subscribe to topics
-    # Subscribe to all messages (empty string means all)
-    socket.subscribe("")
-    print("Subscribed to all messages")
+    # Messages for other topics are dropped inside libzmq
+    topics = [b"weather", b"news", b"sports"]
+    for topic in topics:
+        socket.subscribe(topic)
+    print(f"Subscribed to: {', '.join(t.decode() for t in topics)}")
 
-    # Alternatively, subscribe to specific topics:
-    # socket.subscribe(b"weather")
-    # socket.subscribe(b"news")
-    # print("Subscribed to: weather, news")
+    # Alternatively, subscribe to all messages (empty string means all):
+    # socket.subscribe(b"")
 
     print("Waiting for messages... (Press Ctrl+C to exit)\n")
 
     try:
         count = 0
         while True:
-            # Receive message
-            message = socket.recv_string()
+            # Receive message (topic frame + payload frame)
+            frames = socket.recv_multipart(copy=False)
             count += 1
+            if len(frames) == 2:
+                topic, body = frames
+                message = f"{topic.bytes.decode()} {body.bytes.decode()}"
+            else:
+                # Single-frame publishers put the topic in front of the payload
+                message = b"".join(f.bytes for f in frames).decode()
             print(f"[{count}] Received: {message}")
 
     except KeyboardInterrupt:
@@ -0,0 +1,45 @@
+"""
+CPU pinning for the Python test servers.
+Set ZMQ_TEST_CPUS to a comma-separated CPU list (e.g. "3" or "2,3") to pin a
+server for stable benchmark numbers. When it is unset nothing is pinned.
+"""
+
+import os
+import sys
+
+
+def configured_cpus():
+    """Return the sorted CPUs named by ZMQ_TEST_CPUS, or [] when none are.
+
+    Exits with an error if the list is malformed or names CPUs this process
+    may not run on, so servers fail before binding anything.
+    """
+    value = os.environ.get("ZMQ_TEST_CPUS", "").strip()
+    if not value:
+        return []
+    if not hasattr(os, "sched_setaffinity"):
+        print("ZMQ_TEST_CPUS ignored: CPU pinning is not supported on this platform")
+        return []
+
+    try:
+        cpus = sorted({int(cpu) for cpu in value.split(",")})
+    except ValueError:
+        sys.exit(f"ZMQ_TEST_CPUS must be a comma-separated list of CPU numbers, got {value!r}")
+
+    unavailable = set(cpus) - os.sched_getaffinity(0)
+    if unavailable:
+        sys.exit(f"ZMQ_TEST_CPUS names CPUs this process cannot run on: "
+                 f"{', '.join(map(str, sorted(unavailable)))}")
+    return cpus
+
+
+def pin_to_cpus():
+    """Pin the calling thread to ZMQ_TEST_CPUS, if set.
+
+    Threads started afterwards inherit the affinity, so call this before
+    creating a zmq.Context to keep libzmq's I/O thread on the same CPUs.
+    """
+    cpus = configured_cpus()
+    if cpus:
+        os.sched_setaffinity(0, cpus)
+    return cpus
@@ -2,229 +2,459 @@
 """
 Raw ZMTP 3.1 server implementation for testing our Zig ZMTP client.
 This implements the protocol at the TCP level, not using libzmq.
+Connections are served by worker threads, each running a selector (epoll on
+Linux) loop over its own SO_REUSEPORT listener.
 """
 
+import argparse
+import errno
+import logging
+import os
+import selectors
 import socket
 import struct
 import sys
+import threading
+import time
 
-def send_all(sock, data):
-    """Send all data"""
-    total_sent = 0
-    while total_sent < len(data):
-        sent = sock.send(data[total_sent:])
-        if sent == 0:
-            raise RuntimeError("socket connection broken")
-        total_sent += sent
-
-def recv_exact(sock, n):
-    """Receive exactly n bytes"""
-    data = b''
-    while len(data) < n:
-        chunk = sock.recv(n - len(data))
-        if not chunk:
+from cpu_affinity import configured_cpus
+
+log = logging.getLogger(__name__)
+
+# READY command frame: flags, size, name length, name, property name length,
+# property name, property value length, property value
+_READY_STRUCT = struct.Struct('>BBB5sB11sI3s')
+
+# Frame headers: flags + 1-byte size, or flags + 8-byte size for long frames
+_HDR = struct.Struct('>BB')
+_HDR_LONG = struct.Struct('>BQ')
+
+# ZMTP 3.1 greeting: signature, version 3.1, NULL mechanism, as_server = true
+_GREETING = bytes([0xff] + [0] * 8 + [0x7f, 3, 1]) + b'NULL'.ljust(20, b'\x00') + bytes([1] + [0] * 31)
+
+# READY command advertising Socket-Type REP
+_READY_FRAME = _READY_STRUCT.pack(0x04, _READY_STRUCT.size - 2, 5, b'READY', 11, b'Socket-Type', 3, b'REP')
+
+# READY payloads sent by the REQ peers used in tests: the Zig client, and
+# libzmq, which also sends an empty Identity. These skip property parsing.
+_REQ_READY = _READY_STRUCT.pack(0x04, _READY_STRUCT.size - 2, 5, b'READY', 11, b'Socket-Type', 3, b'REQ')[2:]
+_REQ_READY_PAYLOADS = (
+    _REQ_READY,
+    _REQ_READY + b'\x08Identity\x00\x00\x00\x00',
+)
+
+# Listener created non-blocking and close-on-exec in the socket() call itself
+# where the platform supports it, instead of with follow-up fcntl calls
+_LISTENER_TYPE = socket.SOCK_STREAM | getattr(socket, 'SOCK_NONBLOCK', 0) | getattr(socket, 'SOCK_CLOEXEC', 0)
+
+# Initial read-ahead buffer per connection
+READ_BUFFER_SIZE = 1 << 16
+
+# Kernel send/receive buffer size for the listener and client sockets
+SOCKET_BUFFER_SIZE = 1 << 20
+
+# Seconds a worker stops accepting after running out of file descriptors
+ACCEPT_BACKOFF = 0.1
+
+# The fixed reply, and its REP wire form: MORE delimiter frame + data frame
+_WORLD = b"World"
+_WORLD_WIRE = bytes([0x01, 0x00, 0x00, len(_WORLD)]) + _WORLD
+
+# Send the fixed reply as _WORLD_WIRE instead of framing it per message;
+# --generic-reply turns this off to exercise the generic path
+SPECIALIZE_WORLD = True
+
+class _LazyDecode:
+    """Decode bytes for logging only when the record is actually formatted"""
+
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        return self.data.decode('utf-8', errors='replace')
+
+class Connection:
+    """Per-connection ZMTP state machine driven by the selector loop.
+
+    Every phase either sends a buffer or waits for an exact number of
+    bytes, then hands over to the next phase. Input is read ahead into a
+    per-connection buffer, so one recv can feed several phases.
+    """
+
+    def __init__(self, sel, sock, addr):
+        self.sel = sel
+        self.sock = sock
+        self.addr = addr
+        self.events = selectors.EVENT_WRITE
+        self.next_phase = None
+
+        # Pending output buffers, written with one vectored send
+        self.out = []
+
+        # Read-ahead input buffer; unconsumed bytes are rbuf[rstart:rend]
+        self.rbuf = bytearray(READ_BUFFER_SIZE)
+        self.rview = memoryview(self.rbuf)
+        self.rstart = 0
+        self.rend = 0
+        self.want = None
+        self.ready_header = b''
+
+        # Message being received: frame count and concatenated frame data
+        self.frame_count = 0
+        self.frame_flags = 0
+        self.message = bytearray()
+
+        sel.register(sock, self.events, self)
+
+    def _wait(self, events):
+        """Switch the selector registration only when it changes"""
+        if events != self.events:
+            self.sel.modify(self.sock, events, self)
+            self.events = events
+
+    def send(self, buffers, next_phase):
+        """Send all of buffers, then continue with next_phase()"""
+        self.out = [memoryview(b) for b in buffers if b]
+        self.next_phase = next_phase
+        self._wait(selectors.EVENT_WRITE)
+
+    def recv(self, n, next_phase):
+        """Receive exactly n bytes, then continue with next_phase(data)"""
+        self.want = n
+        self.next_phase = next_phase
+        self._wait(selectors.EVENT_READ)
+
+    def _fill(self):
+        """Read as much as the kernel has into the read-ahead buffer"""
+        buffered = self.rend - self.rstart
+        if self.rstart + self.want > len(self.rbuf):
+            # Move unconsumed bytes to the front, growing for large frames
+            if self.want > len(self.rbuf):
+                rbuf = bytearray(self.want)
+                rbuf[:buffered] = self.rview[self.rstart:self.rend]
+                self.rbuf = rbuf
+                self.rview = memoryview(rbuf)
+            else:
+                self.rbuf[:buffered] = self.rbuf[self.rstart:self.rend]
+            self.rstart = 0
+            self.rend = buffered
+
+        received = self.sock.recv_into(self.rview[self.rend:])
+        if received == 0:
             raise RuntimeError("socket connection broken")
-        data += chunk
-    return data
-
-def send_greeting(sock):
-    """Send ZMTP 3.1 greeting"""
-    greeting = bytearray(64)
-    greeting[0] = 0xff
-    greeting[9] = 0x7f
-    greeting[10] = 3  # version major
-    greeting[11] = 1  # version minor
-    greeting[12:16] = b'NULL'  # mechanism
-    greeting[32] = 1  # as_server = true
-    send_all(sock, greeting)
-    print("✓ Sent greeting (ZMTP 3.1, NULL mechanism, as_server=true)")
-
-def recv_greeting(sock):
-    """Receive and parse ZMTP greeting"""
-    greeting = recv_exact(sock, 64)
-
-    if greeting[0] != 0xff or greeting[9] != 0x7f:
-        raise ValueError("Invalid greeting signature")
-
-    version_major = greeting[10]
-    version_minor = greeting[11]
-    mechanism = greeting[12:32].rstrip(b'\x00').decode('ascii')
-    as_server = greeting[32] == 1
-
-    print(f"✓ Received greeting: version {version_major}.{version_minor}, mechanism {mechanism}, as_server={as_server}")
-    return version_major, version_minor, mechanism
-
-def send_ready_command(sock):
-    """Send READY command"""
-    # Build READY command
-    command_name = b'READY'
-    property_name = b'Socket-Type'
-    property_value = b'REP'
-
-    # Calculate payload size
-    payload_size = 1 + len(command_name) + 1 + len(property_name) + 4 + len(property_value)
-
-    # Build frame
-    frame = bytearray()
-    frame.append(0x04)  # command flag
-    frame.append(payload_size)  # size
-    frame.append(len(command_name))  # command name length
-    frame.extend(command_name)  # command name
-    frame.append(len(property_name))  # property name length
-    frame.extend(property_name)  # property name
-    frame.extend(struct.pack('>I', len(property_value)))  # property value length (big-endian)
-    frame.extend(property_value)  # property value
-
-    send_all(sock, frame)
-    print(f"✓ Sent READY command ({len(frame)} bytes): {frame.hex()}")
-
-def recv_ready_command(sock):
-    """Receive and parse READY command"""
-    # Read frame header
-    header = recv_exact(sock, 2)
-    flags = header[0]
-    size = header[1]
-
-    print(f"  Received frame: flags=0x{flags:02x}, size={size}")
-
-    if flags != 0x04:
-        raise ValueError(f"Expected command frame, got flags=0x{flags:02x}")
-
-    # Read payload
-    payload = recv_exact(sock, size)
-    print(f"✓ Received READY command ({size} bytes payload): {(header + payload).hex()}")
-
-    # Parse command name
-    cmd_name_len = payload[0]
-    cmd_name = payload[1:1+cmd_name_len].decode('ascii')
-
-    if cmd_name != 'READY':
-        raise ValueError(f"Expected READY, got {cmd_name}")
-
-    print(f"  Command: {cmd_name}")
-
-def recv_message(sock):
-    """Receive a complete ZMTP message (multiple frames)"""
-    frames = []
-    frame_num = 0
-
-    while True:
-        frame_num += 1
-
-        # Read frame header
-        header = recv_exact(sock, 2)
-        flags = header[0]
-        size = header[1]
-
-        has_more = (flags & 0x01) != 0
-        is_long = (flags & 0x02) != 0
-
-        if is_long:
-            # Read 8-byte size
-            size_bytes = recv_exact(sock, 8)
-            size = struct.unpack('>Q', size_bytes)[0]
-
-        print(f"  Frame #{frame_num}: flags=0x{flags:02x}, size={size}, more={has_more}")
+        self.rend += received
+
+    def _drain(self):
+        """Feed buffered input to the phases waiting for it"""
+        while self.want is not None and self.rend - self.rstart >= self.want:
+            end = self.rstart + self.want
+            data = self.rbuf[self.rstart:end]
+            self.rstart = end
+            if self.rstart == self.rend:
+                self.rstart = self.rend = 0
+            self.want = None
+            self.next_phase(data)
+
+    def handle(self, events):
+        """Advance the state machine on a readiness event"""
+        try:
+            if events & selectors.EVENT_WRITE:
+                sent = self.sock.sendmsg(self.out)
+                # Drop fully written buffers and trim a partially written one
+                while sent:
+                    if sent >= len(self.out[0]):
+                        sent -= len(self.out.pop(0))
+                    else:
+                        self.out[0] = self.out[0][sent:]
+                        sent = 0
+                if not self.out:
+                    self.next_phase()
+            elif events & selectors.EVENT_READ:
+                self._fill()
+            self._drain()
+        except BlockingIOError:
+            pass
+        except Exception as e:
+            log.exception("❌ Error: %s", e)
+            self.close()
+
+    def close(self):
+        """Unregister and close the connection"""
+        self.want = None
+        self.sel.unregister(self.sock)
+        self.sock.close()
+        log.debug("Connection closed: %s", self.addr)
+
+    # Handshake phase
+
+    def start(self):
+        """Begin the ZMTP handshake"""
+        log.debug("=== Handshake Phase ===")
+        # Greeting and READY go out together in a single sendmsg
+        self.send([_GREETING, _READY_FRAME], self.sent_handshake)
+
+    def sent_handshake(self):
+        log.debug("✓ Sent greeting (ZMTP 3.1, NULL mechanism, as_server=true)")
+        if __debug__ and log.isEnabledFor(logging.DEBUG):
+            log.debug("✓ Sent READY command (%d bytes): %s", len(_READY_FRAME), _READY_FRAME.hex())
+        self.recv(64, self.recv_greeting)
+
+    def recv_greeting(self, greeting):
+        """Parse ZMTP greeting"""
+        if greeting[0] != 0xff or greeting[9] != 0x7f:
+            raise ValueError("Invalid greeting signature")
+
+        version_major = greeting[10]
+        version_minor = greeting[11]
+        mechanism = greeting[12:32].rstrip(b'\x00').decode('ascii')
+        as_server = greeting[32] == 1
+
+        log.debug("✓ Received greeting: version %d.%d, mechanism %s, as_server=%s",
+                  version_major, version_minor, mechanism, as_server)
+        self.recv(2, self.recv_ready_header)
+
+    def recv_ready_header(self, header):
+        """Parse READY command frame header"""
+        flags, size = _HDR.unpack_from(header)
+
+        log.debug("  Received frame: flags=0x%02x, size=%d", flags, size)
+
+        if flags != 0x04:
+            raise ValueError(f"Expected command frame, got flags=0x{flags:02x}")
+
+        self.ready_header = header
+        self.recv(size, self.recv_ready_command)
+
+    def recv_ready_command(self, payload):
+        """Parse READY command"""
+        if __debug__ and log.isEnabledFor(logging.DEBUG):
+            log.debug("✓ Received READY command (%d bytes payload): %s",
+                      len(payload), (self.ready_header + payload).hex())
+
+        if payload in _REQ_READY_PAYLOADS:
+            # Known REQ peer, nothing to parse
+            log.debug("  Command: READY (known REQ peer)")
+        else:
+            # Parse command name
+            cmd_name_len = payload[0]
+            cmd_name = payload[1:1+cmd_name_len].decode('ascii')
+
+            if cmd_name != 'READY':
+                raise ValueError(f"Expected READY, got {cmd_name}")
+
+            log.debug("  Command: %s", cmd_name)
+        log.debug("✓ Handshake complete! Ready for messages.")
+
+        # Message exchange
+        log.debug("=== Message Phase ===")
+        log.debug("Waiting for message...")
+        self.frame_count = 0
+        self.message = bytearray()
+        self.recv(2, self.recv_frame_header)
+
+    # Message phase
+
+    def recv_frame_header(self, header):
+        """Parse a message frame header"""
+        self.frame_flags, size = _HDR.unpack_from(header)
+
+        if self.frame_flags & 0x02:
+            # 8-byte size; its first byte is already in the short header
+            self.recv(7, lambda rest: self.recv_frame_size(_HDR_LONG.unpack_from(header + rest)[1]))
+        else:
+            self.recv_frame_size(size)
+
+    def recv_frame_size(self, size):
+        has_more = (self.frame_flags & 0x01) != 0
+        log.debug("  Frame #%d: flags=0x%02x, size=%d, more=%s",
+                  self.frame_count + 1, self.frame_flags, size, has_more)
 
         # Read frame data
         if size > 0:
-            data = recv_exact(sock, size)
-            frames.append(data)
-            print(f"    Data: {data.hex()} = {data.decode('utf-8', errors='replace')}")
+            self.recv(size, self.recv_frame_data)
         else:
-            frames.append(b'')
-            print(f"    Data: (empty)")
-
-        if not has_more:
-            break
+            self.recv_frame_data(b'')
+
+    def recv_frame_data(self, data):
+        self.frame_count += 1
+        # Empty delimiter frames contribute nothing
+        self.message.extend(data)
+        if __debug__ and log.isEnabledFor(logging.DEBUG):
+            if data:
+                log.debug("    Data: %s = %s", data.hex(), data.decode('utf-8', errors='replace'))
+            else:
+                log.debug("    Data: (empty)")
+
+        if self.frame_flags & 0x01:
+            self.recv(2, self.recv_frame_header)
+        else:
+            self.recv_message(self.message, self.frame_count)
 
-    return frames
+    def recv_message(self, message_data, frame_count):
+        """Handle a complete ZMTP message (multiple frames)"""
+        log.debug("✓ Received complete message with %d frame(s)", frame_count)
+        log.debug("  Message data: %s", _LazyDecode(message_data))
 
-def send_message(sock, data):
-    """Send a message with REP socket pattern (delimiter + data)"""
-    print(f"\nSending reply...")
+        # Send reply
+        self.send_message(_WORLD)
 
-    # Frame 1: Empty delimiter with MORE flag
-    frame1 = bytes([0x01, 0x00])  # MORE flag, size 0
-    send_all(sock, frame1)
-    print(f"  Frame 1: {frame1.hex()} (delimiter)")
+    def send_message(self, data):
+        """Send a message with REP socket pattern (delimiter + data)"""
+        log.debug("Sending reply...")
 
-    # Frame 2: Data with LAST flag
-    frame2 = bytes([0x00, len(data)]) + data  # LAST flag, size, data
-    send_all(sock, frame2)
-    print(f"  Frame 2: {frame2.hex()} (data)")
+        if SPECIALIZE_WORLD and data is _WORLD:
+            log.debug("  Prebuilt reply: %d bytes", len(_WORLD_WIRE))
+            self.send([_WORLD_WIRE], lambda: self.sent_message(len(_WORLD_WIRE)))
+            return
 
-    print(f"✓ Sent message ({len(frame1) + len(frame2)} bytes total)")
+        # Frame 1: Empty delimiter with MORE flag
+        frame1 = bytes([0x01, 0x00])  # MORE flag, size 0
 
-def handle_client(client_sock, addr):
-    """Handle a client connection"""
-    print(f"\n{'='*60}")
-    print(f"New connection from {addr}")
-    print(f"{'='*60}\n")
+        # Frame 2: Data with LAST flag
+        frame2 = struct.pack(f'>BB{len(data)}s', 0x00, len(data), data)  # LAST flag, size, data
 
-    try:
-        # ZMTP handshake
-        print("=== Handshake Phase ===")
-        send_greeting(client_sock)
-        recv_greeting(client_sock)
+        if __debug__ and log.isEnabledFor(logging.DEBUG):
+            log.debug("  Frame 1: %s (delimiter)", frame1.hex())
+            log.debug("  Frame 2: %s (data)", frame2.hex())
 
-        send_ready_command(client_sock)
-        recv_ready_command(client_sock)
+        # Both frames go out in a single vectored write
+        self.send([frame1, frame2], lambda: self.sent_message(len(frame1) + len(frame2)))
 
-        print(f"\n{'='*60}")
-        print("✓ Handshake complete! Ready for messages.")
-        print(f"{'='*60}\n")
+    def sent_message(self, size):
+        log.debug("✓ Sent message (%d bytes total)", size)
+        log.debug("✓ Message exchange complete!")
+        self.close()
 
-        # Message exchange
-        print("=== Message Phase ===")
-        print("\nWaiting for message...")
-        frames = recv_message(client_sock)
+def tune_socket(sock):
+    """Disable Nagle and enlarge the kernel socket buffers"""
+    # Replies are tiny; don't let Nagle hold them back
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
 
-        print(f"\n✓ Received complete message with {len(frames)} frame(s)")
+def accept_client(sel, server_sock):
+    """Accept a client connection and start its handshake.
 
-        # Extract message data (skip empty delimiter frames)
-        message_data = b''.join(f for f in frames if f)
-        print(f"  Message data: {message_data.decode('utf-8', errors='replace')}")
+    Returns False when the process is out of file descriptors.
+    """
+    # A failed accept must not end the worker: its listener would stay bound
+    # and the kernel would keep handing it connections nobody serves
+    try:
+        client_sock, addr = server_sock.accept()
+    except (BlockingIOError, InterruptedError):
+        # Spurious wakeup, or another worker took the connection
+        return True
+    except OSError as e:
+        log.error("❌ accept() failed: %s", e)
+        # The connection stays queued, so the listener stays readable
+        return e.errno not in (errno.EMFILE, errno.ENFILE)
 
-        # Send reply
-        reply = b"World"
-        send_message(client_sock, reply)
+    try:
+        client_sock.setblocking(False)
+        tune_socket(client_sock)
+        conn = Connection(sel, client_sock, addr)
+    except OSError as e:
+        log.error("❌ Could not set up connection from %s: %s", addr, e)
+        client_sock.close()
+        return True
 
-        print(f"\n{'='*60}")
-        print("✓ Message exchange complete!")
-        print(f"{'='*60}\n")
+    log.debug("New connection from %s", addr)
 
-    except Exception as e:
-        print(f"\n❌ Error: {e}")
-        import traceback
-        traceback.print_exc()
+    conn.start()
+    return True
 
+def open_listener(reuse_port):
+    """Open a non-blocking listening socket on the server endpoint"""
+    server_sock = socket.socket(socket.AF_INET, _LISTENER_TYPE)
+    server_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        # Every worker binds its own listener; the kernel balances accepts
+        server_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    # Set before listen() so the receive window applies to accepted sockets
+    tune_socket(server_sock)
+    server_sock.bind(('127.0.0.1', 42123))
+    server_sock.listen(128)
+    if server_sock.getblocking():
+        # No SOCK_NONBLOCK on this platform
+        server_sock.setblocking(False)
+    return server_sock
+
+def serve(server_sock, cpu=None):
+    """Run one worker's selector loop over its listener and connections"""
+    # DefaultSelector is epoll on Linux
+    sel = selectors.DefaultSelector()
+    sel.register(server_sock, selectors.EVENT_READ, None)
+
+    # When accepting is paused, the monotonic time to resume it
+    resume_at = None
+    try:
+        if cpu is not None:
+            # Keep the worker and its connection state on one core
+            os.sched_setaffinity(0, {cpu})
+        while True:
+            timeout = None
+            if resume_at is not None:
+                timeout = resume_at - time.monotonic()
+                if timeout <= 0:
+                    sel.register(server_sock, selectors.EVENT_READ, None)
+                    resume_at = timeout = None
+            for key, events in sel.select(timeout):
+                if key.data is not None:
+                    key.data.handle(events)
+                elif not accept_client(sel, key.fileobj):
+                    # Stop polling the listener instead of spinning on it
+                    # until closed connections free some descriptors
+                    sel.unregister(server_sock)
+                    resume_at = time.monotonic() + ACCEPT_BACKOFF
     finally:
-        client_sock.close()
-        print(f"Connection closed: {addr}\n")
+        sel.close()
+        server_sock.close()
 
 def main():
-    server_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    server_sock.bind(('127.0.0.1', 42123))
-    server_sock.listen(1)
+    parser = argparse.ArgumentParser(description="Raw ZMTP 3.1 test server")
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help="log handshake and frame details")
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help="accept threads; more than 1 gives each its own SO_REUSEPORT listener")
+    parser.add_argument('--generic-reply', action='store_true',
+                        help="frame every reply instead of sending the prebuilt one")
+    args = parser.parse_args()
+
+    global SPECIALIZE_WORLD
+    SPECIALIZE_WORLD = not args.generic_reply
+
+    # Per-connection and per-frame detail only with -v
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO, format='%(message)s')
+
+    # Spread workers across ZMQ_TEST_CPUS; checked before anything is bound
+    cpus = configured_cpus()
+
+    workers = max(1, args.workers) if hasattr(socket, 'SO_REUSEPORT') else 1
+    listeners = [open_listener(workers > 1) for _ in range(workers)]
 
     print("=" * 60)
     print("Raw ZMTP 3.1 Test Server")
     print("=" * 60)
     print("Listening on: tcp://127.0.0.1:42123")
     print("Protocol: ZMTP 3.1, NULL mechanism, REP socket")
+    print(f"Workers: {workers}")
     print("=" * 60)
+    if not args.verbose:
+        print("Run with -v for handshake and frame details")
     print("\nWaiting for connections...\n")
 
+    threads = [
+        threading.Thread(target=serve, args=(sock, cpus[i % len(cpus)] if cpus else None), daemon=True)
+        for i, sock in enumerate(listeners)
+    ]
+    for thread in threads:
+        thread.start()
+
     try:
-        while True:
-            client_sock, addr = server_sock.accept()
-            handle_client(client_sock, addr)
+        for thread in threads:
+            thread.join()
     except KeyboardInterrupt:
         print("\n\nServer shutting down...")
-    finally:
-        server_sock.close()
 
 if __name__ == "__main__":
     main()
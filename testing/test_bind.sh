@@ -11,15 +11,18 @@ echo "ZeroMQ bind() Implementation Test"
 echo "======================================"
 echo ""
 
+# Python interpreter for the interop scripts (e.g. PYTHON=pypy3)
+PYTHON=${PYTHON:-python3}
+
 # Check if Python is available
-if ! command -v python3 &> /dev/null; then
-    echo "Error: python3 is required for testing"
+if ! command -v "$PYTHON" &> /dev/null; then
+    echo "Error: $PYTHON is required for testing"
     exit 1
 fi
 
 # Check if pyzmq is installed
 PYTHON_TESTS_ENABLED=true
-if ! python3 -c "import zmq" &> /dev/null; then
+if ! "$PYTHON" -c "import zmq" &> /dev/null; then
     echo "Warning: pyzmq is not installed - Python interop tests will be skipped"
     echo "Install with: pip install pyzmq"
     PYTHON_TESTS_ENABLED=false
@@ -88,7 +91,7 @@ if [ "$PYTHON_TESTS_ENABLED" = true ]; then
 
     echo "Starting Python REQ client..."
     cd testing
-    timeout 10 python3 test_zmq_client.py || true
+    timeout 10 "$PYTHON" test_zmq_client.py || true
     cd ..
     echo ""
     echo "Stopping REP server..."
@@ -114,7 +117,7 @@ if [ "$PYTHON_TESTS_ENABLED" = true ]; then
 
     echo "Starting Python SUB client for 10 seconds..."
     cd testing
-    timeout 10 python3 ZMQSubClient.py || true
+    timeout 10 "$PYTHON" ZMQSubClient.py || true
     cd ..
     echo ""
     echo "Stopping PUB server..."
@@ -10,14 +10,17 @@ echo "ZeroMQ PUB/SUB Implementation Test"
 echo "======================================"
 echo ""
 
+# Python interpreter for the interop scripts (e.g. PYTHON=pypy3)
+PYTHON=${PYTHON:-python3}
+
 # Check if Python is available
-if ! command -v python3 &> /dev/null; then
-    echo "Error: python3 is required for testing"
+if ! command -v "$PYTHON" &> /dev/null; then
+    echo "Error: $PYTHON is required for testing"
     exit 1
 fi
 
 # Check if pyzmq is installed
-if ! python3 -c "import zmq" &> /dev/null; then
+if ! "$PYTHON" -c "import zmq" &> /dev/null; then
     echo "Error: pyzmq is not installed"
     echo "Please install it with: pip install pyzmq"
     exit 1
@@ -38,7 +41,7 @@ echo "Test 1: Python PUB -> Zig SUB"
 echo "======================================"
 echo ""
 echo "Starting Python PUB server in background..."
-python3 testing/ZMQPubServer.py &
+"$PYTHON" testing/ZMQPubServer.py -v &
 PUB_PID=$!
 sleep 1
 
@@ -63,7 +66,7 @@ PUB_PID=$!
 sleep 3
 
 echo "Starting Python SUB client for 8 seconds..."
-timeout 8 python3 -c "
+timeout 8 "$PYTHON" -c "
 import zmq
 import time
 
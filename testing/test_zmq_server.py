@@ -1,18 +1,36 @@
 #!/usr/bin/env python3
 """
 Test ZMQ REP server with detailed logging to debug ZMTP protocol communication.
+Run with -v to log every message.
 """
 
+import argparse
+import logging
 import zmq
 import sys
 
+from cpu_affinity import pin_to_cpus
+
+log = logging.getLogger(__name__)
+
+# Reply frame shared by every send; libzmq references it instead of copying
+REPLY = zmq.Frame(b"World")
+
 def main():
+    parser = argparse.ArgumentParser(description="ZMQ REP debug server")
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help="log every message received and sent")
+    args = parser.parse_args()
+
+    # Per-message detail only with -v
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO, format='%(message)s')
+
+    pin_to_cpus()
     context = zmq.Context()
     socket = context.socket(zmq.REP)
 
     # Set socket options for debugging
     socket.setsockopt(zmq.LINGER, 0)
-    socket.setsockopt(zmq.RCVTIMEO, 5000)  # 5 second timeout
 
     socket.bind("tcp://127.0.0.1:42123")
 
@@ -25,29 +43,33 @@ def main():
     print("=" * 60)
     print("\nWaiting for connections...\n")
 
+    # Wait for requests with a single poll instead of a receive timeout
+    poller = zmq.Poller()
+    poller.register(socket, zmq.POLLIN)
+
     message_count = 0
 
     try:
         while True:
-            print(f"\n[{message_count}] Calling recv()...")
+            log.debug("[%d] Polling for message...", message_count)
 
-            try:
-                message = socket.recv()
-                message_count += 1
+            events = dict(poller.poll(5000))  # 5 second timeout
+            if socket not in events:
+                log.info("[%d] Timeout waiting for message (5s)", message_count)
+                continue
 
-                print(f"[{message_count}] ✓ Received message!")
-                print(f"    Length: {len(message)} bytes")
-                print(f"    Hex: {message.hex()}")
-                print(f"    Text: {message.decode('utf-8', errors='replace')}")
+            message = socket.recv(zmq.NOBLOCK)
+            message_count += 1
 
-                # Send reply
-                reply = b"World"
-                socket.send(reply)
-                print(f"[{message_count}] ✓ Sent reply: {reply.decode()}")
+            if __debug__ and log.isEnabledFor(logging.DEBUG):
+                log.debug("[%d] ✓ Received message!", message_count)
+                log.debug("    Length: %d bytes", len(message))
+                log.debug("    Hex: %s", message.hex())
+                log.debug("    Text: %s", message.decode('utf-8', errors='replace'))
 
-            except zmq.Again:
-                print(f"[{message_count}] Timeout waiting for message (5s)")
-                continue
+            # Send reply
+            socket.send(REPLY, copy=False, track=False)
+            log.debug("[%d] ✓ Sent reply: %s", message_count, REPLY.bytes)
 
     except KeyboardInterrupt:
         print("\n\n" + "=" * 60)